@@ -1,22 +1,32 @@
 # %%
 import pandas as pd
 
+try:
+    import pyarrow  # noqa: F401
+    string_dtype = 'string[pyarrow]'  # Arrow-backed strings when pyarrow is installed
+except ImportError:
+    string_dtype = 'string'
+
 # %%
-plants_original_df = pd.read_csv('../data/plants_to_scrape_for_certs_original_01-03.csv')
-plants_with_info_df = pd.read_csv('../data/plants_with_info_certs_updated.csv')
-plants_without_info_df = pd.read_csv('../data/plants_without_info_certs_updated.csv')
+# Read the text columns as strings up front, so pandas skips type inference
+text_columns = ['Company name', 'Country', 'City', 'Province', 'Site address', 'Company website']
+csv_options = dict(dtype={c: string_dtype for c in text_columns}, na_values=['', 'nan', 'NaN', 'None'])
+
+plants_original_df = pd.read_csv('../data/plants_to_scrape_for_certs_original_01-03.csv', **csv_options)
+plants_with_info_df = pd.read_csv('../data/plants_with_info_certs_updated.csv', **csv_options)
+plants_without_info_df = pd.read_csv('../data/plants_without_info_certs_updated.csv', **csv_options)
 
 # %%
-# First, combine the two info dataframes
-combined_info_df = pd.concat([plants_with_info_df, plants_without_info_df], ignore_index=True)
-# Remove duplicates from combined info before merging
-combined_info_df = combined_info_df.drop_duplicates()
+# Find the companies from the original df that are not in either info dataframe
+combined_names = pd.Index(pd.concat([plants_with_info_df['Company name'], plants_without_info_df['Company name']]))
+original_by_name = plants_original_df.set_index('Company name')
+missing_names = original_by_name.index.difference(combined_names, sort=False)
+missing_rows = original_by_name.loc[missing_names].reset_index()
 
-# Add any missing rows from original df to combined_info_df
-missing_rows = plants_original_df[~plants_original_df['Company name'].isin(combined_info_df['Company name'])]
-combined_info_df = pd.concat([combined_info_df, missing_rows], ignore_index=True)
+# Combine the two info dataframes with the missing rows in a single concat
+combined_info_df = pd.concat([plants_with_info_df, plants_without_info_df, missing_rows], ignore_index=True)
 
 # Remove any duplicates and save
-combined_info_df = combined_info_df.drop_duplicates()
+combined_info_df = combined_info_df.drop_duplicates(ignore_index=True)
 combined_info_df.to_csv('../data/plants_updated_certification_and_info.csv', index=False)
 
@@ -1,10 +1,18 @@
 # %%
+import asyncio
+import atexit
 import pandas as pd
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
 import googlemaps
+import hashlib
+import random
+import re
+import shelve
 import time
 import os
 import csv
+import logging
 from dotenv import load_dotenv
 import googleapiclient.errors
 
@@ -14,30 +22,128 @@ load_dotenv()  # Load environment variables from a .env file
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')  # API key for Google services
 GOOGLE_CSE_ID = os.getenv('GOOGLE_CSE_ID')    # Custom Search Engine ID
 
+# %%
+# Per-row progress is logged at INFO and API chatter at DEBUG; set LOG_LEVEL to see them
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'WARNING'))
+logger = logging.getLogger(__name__)
+
 # %%
 # Initialize the Google Maps client using the provided API key
 gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
 
 # %%
 # Define filenames for managing the state of the script and logging errors
-STATE_FILE = 'script_state.csv'  # File to save the current state of the script
+STATE_FILE = 'script_state.parquet'  # File to save the current state of the script (CSV if pyarrow is missing)
 ERROR_FILE = 'errors.csv'         # File to log errors encountered during execution
+API_CACHE_FILE = 'api_cache'      # Shelve file caching API responses across runs
+
+# Columns this script looks up and fills in when missing
+INFO_COLUMNS = ['Company website', 'Country', 'City', 'Province', 'Site address']
+
+# Read the text columns as strings up front, so pandas skips type inference
+# and mostly-empty columns don't load as float64. The Arrow-backed string
+# dtype is faster for isna/isin but needs pyarrow, which is optional here.
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+CSV_DTYPES = {column: STRING_DTYPE for column in ['Company name'] + INFO_COLUMNS}
+CSV_NA_VALUES = ['', 'nan', 'NaN', 'None']
+
+# Aggregator and social media domains that don't count as a company website
+EXCLUDED_DOMAINS_RE = re.compile(r'(?:facebook|linkedin|twitter|instagram|youtube)\.com', re.IGNORECASE)
+
+# Concurrency and rate limits shared by the Google API calls
+MAX_CONCURRENT_ROWS = 8        # Rows looked up at the same time
+CHECKPOINT_EVERY = 50          # Rows (or searches) between state snapshots
+MAX_REQUESTS_PER_SECOND = 10   # Upper bound on API calls started per second
+SEARCH_BATCH_SIZE = 50         # Custom Search queries sent per batched HTTP request
+
+# Retry settings for throttled (429) or failing (5xx) API calls
+MAX_RETRY_ATTEMPTS = 3         # Attempts per call before giving up on the row
+RETRY_BASE_DELAY = 1           # Seconds, doubled after each failed attempt
+RETRY_MAX_DELAY = 30           # Cap on the backoff between attempts
+MAX_CONSECUTIVE_FAILURES = 3   # Rows in a row that exhaust retries before stopping the run
+
+# %%
+class RateLimiter:
+    """
+    Space out coroutine calls so no more than max_rate of them start per second.
+    A call standing in for several API requests (e.g. a batch) can pass a higher cost.
+    """
+    def __init__(self, max_rate):
+        self.interval = 1 / max_rate
+        self.next_slot = 0.0
+
+    async def wait(self, cost=1):
+        now = time.monotonic()
+        slot = max(now, self.next_slot)  # Claim the next free slot before sleeping
+        self.next_slot = slot + self.interval * cost
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+api_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
 
 # %%
-def create_search_query(row):
+def is_retryable(error):
     """
-    Generate a search query based on company information.
-    Exclude any None or NaN values and concatenate the components with spaces.
+    Classify an API error as transient (throttling, server or transport trouble) or not.
     """
-    components = [
-        row['Company name'],
-        row['Country'],
-        row['City'],
-        row['Province'],
-        row['Site address']
-    ]
-    query = ' '.join(str(item) for item in components if pd.notna(item))  # Concatenate valid components
-    return query
+    if isinstance(error, googleapiclient.errors.HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    if isinstance(error, googlemaps.exceptions.HTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status == 'OVER_QUERY_LIMIT'
+    return isinstance(error, (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout))
+
+# %%
+async def call_with_retry(func, *args, **kwargs):
+    """
+    Run a blocking API call in a worker thread under the shared rate limit.
+    Transient errors are retried with exponential backoff and jitter; others are raised immediately.
+    """
+    for attempt in range(MAX_RETRY_ATTEMPTS):
+        await api_limiter.wait()
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt == MAX_RETRY_ATTEMPTS - 1:
+                raise
+            wait_time = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) + random.uniform(0, 1)
+            logger.warning("Transient API error (%s), retrying in %.1fs...", e, wait_time)
+            await asyncio.sleep(wait_time)
+
+# %%
+def cache_key(kind, value):
+    """
+    Build a cache key from the kind of API call and a hash of its query.
+    """
+    return f"{kind}:{hashlib.sha1(value.encode('utf-8')).hexdigest()}"
+
+# %%
+async def cached_call(cache, key, func, *args, **kwargs):
+    """
+    Return a cached API response if there is one, otherwise make the call and cache its result.
+    """
+    if key in cache:
+        return cache[key]  # Already answered (and billed) on an earlier run
+    result = await call_with_retry(func, *args, **kwargs)
+    cache[key] = result
+    return result
+
+# %%
+def create_search_queries(df):
+    """
+    Generate a search query for every row based on company information.
+    Exclude any missing values and concatenate the components with spaces.
+    """
+    components = df[['Company name', 'Country', 'City', 'Province', 'Site address']].astype(STRING_DTYPE)
+    queries = components['Company name'].str.cat(
+        [components[column] for column in components.columns[1:]], sep=' ', na_rep=''
+    )  # Concatenate all components in one vectorized pass
+    return queries.str.replace(r'\s+', ' ', regex=True).str.strip()  # Drop the gaps left by missing values
 
 # %%
 def extract_website_url(search_result):
@@ -46,47 +152,43 @@ def extract_website_url(search_result):
     Exclude known aggregator or social media domains to ensure valid results.
     """
     if not search_result.get('items'):
-        print("No search results found.")  # No results returned from the search
+        logger.debug("No search results found.")  # No results returned from the search
         return None
     
-    excluded_domains = [
-        'facebook.com', 'linkedin.com', 'twitter.com',
-        'instagram.com', 'youtube.com'
-    ]
-    print("Checking the first five results for a legitimate domain...")
+    logger.debug("Checking the first five results for a legitimate domain...")
     # Evaluate the first five results for a valid domain
     for index, item in enumerate(search_result['items'][:5]):
-        url = item['link'].lower()  # Normalize URL to lowercase
-        print(f"Checking result {index + 1}: {url}")
-        if not any(domain in url for domain in excluded_domains):  # Check against excluded domains
-            print(f"Valid website found: {item['link']}")
+        url = item['link']
+        logger.debug("Checking result %d: %s", index + 1, url)
+        if not EXCLUDED_DOMAINS_RE.search(url):  # Check against excluded domains
+            logger.debug("Valid website found: %s", item['link'])
             return item['link']  # Return the first valid website found
     
-    print("No valid websites found in the top results.")  # No valid websites identified
+    logger.debug("No valid websites found in the top results.")  # No valid websites identified
     return None
 
 # %%
-def update_location_info(row):
+async def fetch_place_details(row, cache):
     """
-    Enhance missing location information using the Google Places API.
+    Look up the company with the Google Places API and return the raw details of the best match.
     Evaluate multiple Places results to identify the most relevant one.
     """
     try:
         # Build a location-based search query (company + city + country).
         search_query = row['Company name']
-        print(f"Constructing search query for: {search_query}")
+        logger.debug("Constructing search query for: %s", search_query)
         if pd.notna(row['City']):
             search_query += f", {row['City']}"  # Add city to the search query if available
-            print(f"Added city to search query: {row['City']}")
+            logger.debug("Added city to search query: %s", row['City'])
         if pd.notna(row['Country']):
             search_query += f", {row['Country']}"  # Add country to the search query if available
-            print(f"Added country to search query: {row['Country']}")
+            logger.debug("Added country to search query: %s", row['Country'])
 
-        print("Sending request to Google Places API...")
-        places_result = gmaps.places(search_query)  # Query Google Places API for location data
+        logger.debug("Sending request to Google Places API...")
+        places_result = await cached_call(cache, cache_key('places', search_query), gmaps.places, search_query)  # Query Google Places API for location data
 
         if places_result.get('results'):
-            print("Results received from Google Places API.")
+            logger.debug("Results received from Google Places API.")
             # Select the best place if available, or default to the first.
             # Further refinement could be done by checking user ratings, 
             # proximity, or other heuristics.
@@ -98,179 +200,312 @@ def update_location_info(row):
                 reverse=True
             )
             best_place = sorted_results[0]  # Select the best-rated place
-            print(f"Best place found: {best_place['name']} with rating: {best_place.get('rating', 'N/A')}")
+            logger.debug("Best place found: %s with rating: %s", best_place['name'], best_place.get('rating', 'N/A'))
             
             # Retrieve place details
-            print(f"Fetching details for place ID: {best_place['place_id']}")
-            place_details = gmaps.place(best_place['place_id'])['result']
-            
-            address_components = place_details.get('address_components', [])  # Extract address components
-            
-            location_info = {
-                'Country': None,
-                'City': None,
-                'Province': None,
-                'Site address': place_details.get('formatted_address')  # Get formatted address
-            }
-            
-            for component in address_components:
-                types = component['types']
-                if 'country' in types:
-                    location_info['Country'] = component['long_name']  # Capture country name
-                    print(f"Country found: {component['long_name']}")
-                elif 'locality' in types:
-                    location_info['City'] = component['long_name']  # Capture city name
-                    print(f"City found: {component['long_name']}")
-                elif 'administrative_area_level_1' in types:
-                    location_info['Province'] = component['long_name']  # Capture province name
-                    print(f"Province found: {component['long_name']}")
-            
-            return location_info  # Return the updated location information
+            logger.debug("Fetching details for place ID: %s", best_place['place_id'])
+            place_id = best_place['place_id']
+            place_details = (await cached_call(cache, cache_key('place', place_id), gmaps.place, place_id))['result']
+            return place_details  # Parsed later together with the other rows' details
             
     except Exception as e:
-        print(f"Error updating location info: {str(e)}")  # Log any errors encountered
+        if is_retryable(e):
+            raise  # Retries are exhausted; let the caller count the failure
+        logger.warning("Error updating location info: %s", e)  # Log any errors encountered
     
-    return None  # Return None if no updates were made
+    return None  # Return None if no place was found
+
+# %%
+def parse_location_info(place_details):
+    """
+    Extract country, city, province and site address from a Places details result.
+    """
+    address_components = place_details.get('address_components', [])  # Extract address components
+    
+    location_info = {
+        'Country': None,
+        'City': None,
+        'Province': None,
+        'Site address': place_details.get('formatted_address')  # Get formatted address
+    }
+    
+    for component in address_components:
+        types = component['types']
+        if 'country' in types:
+            location_info['Country'] = component['long_name']  # Capture country name
+            logger.debug("Country found: %s", component['long_name'])
+        elif 'locality' in types:
+            location_info['City'] = component['long_name']  # Capture city name
+            logger.debug("City found: %s", component['long_name'])
+        elif 'administrative_area_level_1' in types:
+            location_info['Province'] = component['long_name']  # Capture province name
+            logger.debug("Province found: %s", component['long_name'])
+    
+    return location_info
+
+# %%
+def apply_location_info(df, place_details):
+    """
+    Fill missing location fields from Places details results (keyed by row index) in a single pass.
+    Fields that already hold a value are left as they are.
+    """
+    if not place_details:
+        return df
+    location_df = pd.DataFrame.from_dict(
+        {idx: parse_location_info(details) for idx, details in place_details.items()}, orient='index'
+    )
+    # Update only the pieces we're missing, and only with non-empty values
+    fill = df.loc[location_df.index, location_df.columns].isna() & location_df.notna() & location_df.ne('')
+    df.update(location_df.where(fill))
+    return df
+
+# %%
+def state_csv_file(filename):
+    """
+    Name of the CSV fallback used for a state file when Parquet can't be written.
+    """
+    return os.path.splitext(filename)[0] + '.csv'
 
 # %%
 def save_state(df, filename=STATE_FILE):
     """
-    Persist the current state of the data to a CSV file for later resumption.
+    Persist the current state of the data to a Parquet file for later resumption.
+    Falls back to CSV when no Parquet engine (pyarrow) is installed.
     """
-    print(f"Saving current state to {filename}...")
-    df.to_csv(filename, index=False)  # Save DataFrame to CSV
-    print("State saved successfully.")
+    logger.info("Saving current state to %s...", filename)
+    try:
+        df.to_parquet(filename, index=False)  # Save DataFrame to Parquet
+    except ImportError:
+        df.to_csv(state_csv_file(filename), index=False)  # Save DataFrame to CSV
+    logger.debug("State saved successfully.")
 
 # %%
 def load_state(filename=STATE_FILE):
     """
     Load a previously saved state file if it exists (i.e., resuming from a prior run).
     """
-    print(f"Checking for existing state file: {filename}")
+    logger.debug("Checking for existing state file: %s", filename)
     if os.path.exists(filename):
-        print("State file found. Loading...")
-        return pd.read_csv(filename)  # Load DataFrame from CSV if it exists
-    print("No state file found. Starting fresh.")  # No saved state found
+        logger.info("State file found. Loading...")
+        return pd.read_parquet(filename)  # Load DataFrame from Parquet if it exists
+    if os.path.exists(state_csv_file(filename)):
+        logger.info("CSV state file found. Loading...")
+        return pd.read_csv(state_csv_file(filename), dtype=CSV_DTYPES, na_values=CSV_NA_VALUES)  # Fall back to CSV
+    logger.debug("No state file found. Starting fresh.")  # No saved state found
     return None
 
 # %%
+error_logs = {}  # Open error files and their CSV writers by filename, kept for the whole run
+
 def log_error(idx, message, row, filename=ERROR_FILE):
     """
     Record an error row to a separate CSV for debugging or re-processing later.
+    The file is opened on the first error and stays open until the script exits.
     """
-    print(f"Logging error for index {idx}: {message}")  # Log the error message
-    with open(filename, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow([idx, message, dict(row)])  # Write error details to CSV
-    print(f"Error logged for index {idx} successfully.")
+    logger.debug("Logging error for index %s: %s", idx, message)  # Log the error message
+    if filename not in error_logs:
+        f = open(filename, 'a', newline='', encoding='utf-8')
+        atexit.register(f.close)
+        error_logs[filename] = (f, csv.writer(f))
+    f, writer = error_logs[filename]
+    writer.writerow([idx, message, dict(row)])  # Write error details to CSV
+    f.flush()  # Keep the file current in case the run is interrupted
+    logger.debug("Error logged for index %s successfully.", idx)
 
 # %%
-def find_missing_info(df):
+def apply_updates(df, updates):
+    """
+    Apply the accumulated per-row updates to the DataFrame in a single pass.
+    Each update is a dict holding the row index under 'idx' plus the new field values.
+    """
+    if updates:
+        df.update(pd.DataFrame(updates).set_index('idx'))
+    return df
+
+# %%
+async def find_missing_info(df):
     """Identify missing websites and update location information with error logging."""
     # Attempt to resume from a partial state if available
     resumed_df = load_state()
     if resumed_df is not None:
-        print("Resuming from saved state...")
+        logger.info("Resuming from saved state...")
         df = resumed_df  # Use the saved state if available
     
     # Create Google Search API service
     service = build('customsearch', 'v1', developerKey=GOOGLE_API_KEY)
     
     # Create a copy of rows that still have missing information
-    missing_info = df[
-        df['Company website'].isna() |
-        df['Country'].isna() |
-        df['City'].isna() |
-        df['Province'].isna() |
-        df['Site address'].isna()
-    ].copy()  # Filter DataFrame for rows with missing data
+    missing_info = df[df[INFO_COLUMNS].isna().any(axis=1)].copy()  # Filter DataFrame for rows with missing data
     
     # Counter for daily quota usage
     requests_count = 0
     daily_quota = 1000  # Set to 1000 for free tier with billing enabled
+    quota_reached = False
     total_missing = len(missing_info)  # Total number of entries with missing information
-    print(f"Total entries with missing information: {total_missing}")
+    place_details = {}  # Raw Places details by row index, parsed and applied to df in one pass
+    website_updates = []  # New websites per row, applied to df in one pass
+    logger.info("Total entries with missing information: %d", total_missing)
+
+    consecutive_failures = 0  # Rows in a row whose API calls exhausted their retries
+    rows_done = 0  # Rows whose location lookup has finished, for checkpointing
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_ROWS)  # Bound the rows in flight
+    stop_requested = asyncio.Event()  # Set once no further API calls should be made
+    searches = []  # Indexes of rows still missing a website once their location lookup is done
+    search_responses = {}  # Batched search results by request ID (the row index)
+
+    def record_failure(idx, row, error):
+        nonlocal consecutive_failures
+        if is_retryable(error):
+            consecutive_failures += 1
+            if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                # Persistent throttling; store state & exit rather than burn more quota
+                logger.warning("API still failing after retries on %d rows. Stopping...", consecutive_failures)
+                stop_requested.set()
+        logger.error("Error processing row %s: %s", idx, error)  # Log any errors encountered
+        log_error(idx, str(error), row)  # Log the error for later review
+
+    def record_website(idx, result):
+        website_url = extract_website_url(result)  # Extract website URL from search results
+        if website_url:
+            website_updates.append({'idx': idx, 'Company website': str(website_url)})  # Record the website URL
+            logger.debug("Updated website for row %d.", idx + 1)
+
+    def collect_search_response(request_id, response, exception):
+        search_responses[request_id] = (response, exception)
+
+    def apply_results():
+        apply_location_info(df, place_details)
+        return apply_updates(df, website_updates)
+
+    def checkpoint():
+        # Snapshot progress so a crash doesn't lose the API calls already paid for
+        save_state(apply_results())
 
-    for idx, row in missing_info.iterrows():
-        print(f"Processing row {idx + 1}/{total_missing}...")
+    async def process_row(idx, row):
+        nonlocal consecutive_failures, rows_done
+        async with semaphore:
+            if stop_requested.is_set():
+                return  # Leave the row for the next run
+            logger.info("Processing row %d/%d...", idx + 1, total_missing)
+            
+            # Determine if we still need to fill location or website
+            location_missing = (
+                pd.isna(row['Country']) or 
+                pd.isna(row['City']) or 
+                pd.isna(row['Province']) or 
+                pd.isna(row['Site address'])
+            )
+            website_missing = pd.isna(row['Company website'])
+            
+            try:
+                # Look up location info if any location data is missing
+                if location_missing:
+                    details = await fetch_place_details(row, api_cache)
+                    if details:
+                        place_details[idx] = details
+                    logger.debug("Fetched location info for row %d.", idx + 1)
+            except Exception as e:
+                record_failure(idx, row, e)
+            else:
+                consecutive_failures = 0
+                # Queue the website search; it uses the location info found above
+                if website_missing:
+                    searches.append(idx)
+            
+            rows_done += 1
+            if rows_done % CHECKPOINT_EVERY == 0:
+                checkpoint()
+
+    async def search_websites():
+        nonlocal requests_count, quota_reached, consecutive_failures
+        if not searches:
+            return
+        # Build every search query at once, from the rows as updated by the location lookups
+        queries = create_search_queries(df.loc[searches])
         
-        # Determine if we still need to fill location or website
-        location_missing = (
-            pd.isna(row['Country']) or 
-            pd.isna(row['City']) or 
-            pd.isna(row['Province']) or 
-            pd.isna(row['Site address'])
-        )
-        website_missing = pd.isna(row['Company website'])
+        pending = []  # (idx, cache key, request, attempt, earliest retry time) for searches the cache can't answer
+        for idx in searches:
+            query = queries[idx]  # Search query for the company
+            search_key = cache_key('cse', query)
+            if search_key in api_cache:
+                record_website(idx, api_cache[search_key])  # Cached searches don't count against the quota
+            elif requests_count < daily_quota:
+                requests_count += 1
+                request = service.cse().list(
+                    q=query,
+                    cx=GOOGLE_CSE_ID,
+                    num=5
+                )
+                pending.append((idx, search_key, request, 0, 0))
+            elif not quota_reached:
+                # Instead of sleeping 24 hours, let's store state & exit
+                logger.warning("Reached daily quota of %d requests. Stopping...", daily_quota)
+                quota_reached = True
         
-        try:
-            # Update location info if any location data is missing
-            if location_missing:
-                location_info = update_location_info(row)
-                if location_info:
-                    for field, value in location_info.items():
-                        # Update only if we're missing that piece
-                        if pd.isna(row[field]) and value:
-                            if pd.isna(df.at[idx, field]) and value is not None:
-                                # Explicitly convert column to string dtype before setting value
-                                if df[field].dtype != 'object':
-                                    df[field] = df[field].astype('object')
-                                df.at[idx, field] = str(value)  # Update the DataFrame with new location info
-                print(f"Updated location info for row {idx + 1}.")
-                # Sleep to be a bit polite to the API
-                time.sleep(2)
+        # Send the searches many at a time in batched HTTP requests
+        loop = asyncio.get_running_loop()
+        while pending:
+            if stop_requested.is_set():
+                break  # Leave the remaining searches for the next run
+            chunk, pending = pending[:SEARCH_BATCH_SIZE], pending[SEARCH_BATCH_SIZE:]
+            # Searches being retried wait out their backoff before going into a batch
+            wait_time = max(retry_at for *_, retry_at in chunk) - loop.time()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            batch = service.new_batch_http_request(callback=collect_search_response)
+            for idx, search_key, request, attempt, retry_at in chunk:
+                batch.add(request, request_id=str(idx))
             
-            # Update website if missing
-            if website_missing:
-                query = create_search_query(df.loc[idx])  # Create search query for the company
-                
-                try:
-                    result = service.cse().list(
-                        q=query,
-                        cx=GOOGLE_CSE_ID,
-                        num=5
-                    ).execute()  # Execute the search query
-                except googleapiclient.errors.HttpError as e:
-                    if e.resp.status == 429:  # Too Many Requests
-                        print("Hit actual API quota limit!")
-                        save_state(df)  # Save state before exiting
-                        return df
-                    else:
-                        raise e
-                
-                website_url = extract_website_url(result)  # Extract website URL from search results
-                if website_url:
-                    # Convert column to string dtype before setting value
-                    if df['Company website'].dtype != 'object':
-                        df['Company website'] = df['Company website'].astype('object')
-                    df.at[idx, 'Company website'] = str(website_url)  # Update the DataFrame with the website URL
-                    print(f"Updated website for row {idx + 1}.")
-                
-                requests_count += 1  # Increment the request count
-                if requests_count >= daily_quota:
-                    # Instead of sleeping 24 hours, let's store state & exit
-                    print(f"Reached daily quota of {daily_quota} requests. Stopping...")
-                    save_state(df)  # Save state before exiting
-                    return df
-                else:
-                    # Minimal rate limit
-                    time.sleep(1)  # Sleep to respect API rate limits
+            try:
+                await api_limiter.wait(cost=len(chunk) - 1)  # Every search in the batch counts toward the rate
+                # httplib2 connections aren't thread-safe, so each batch gets its own
+                await call_with_retry(batch.execute, http=build_http())
+            except Exception as e:
+                for idx, search_key, request, attempt, retry_at in chunk:
+                    record_failure(idx, df.loc[idx], e)
+                continue
             
-        except Exception as e:
-            print(f"Error processing row {idx}: {str(e)}")  # Log any errors encountered
-            log_error(idx, str(e), df.loc[idx])  # Log the error for later review
-            continue  # Continue to the next row
+            for idx, search_key, request, attempt, retry_at in chunk:
+                result, error = search_responses.pop(str(idx))
+                if error is not None:
+                    if is_retryable(error) and attempt < MAX_RETRY_ATTEMPTS - 1:
+                        # Throttled or a server error on this search alone; send it again in a later batch
+                        backoff = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) + random.uniform(0, 1)
+                        logger.warning("Transient API error for row %s (%s), retrying in %.1fs...", idx, error, backoff)
+                        pending.append((idx, search_key, request, attempt + 1, loop.time() + backoff))
+                        continue
+                    record_failure(idx, df.loc[idx], error)
+                    continue
+                consecutive_failures = 0
+                api_cache[search_key] = result
+                record_website(idx, result)
+            checkpoint()  # Snapshot after every batch of searches
+
+    # Cache API responses on disk so re-runs don't pay for queries already answered
+    with shelve.open(API_CACHE_FILE) as api_cache:
+        # Plain tuples are much cheaper to produce than iterrows' Series;
+        # each row is handed on as a dict of column name to value
+        columns = missing_info.columns.tolist()
+        await asyncio.gather(*(
+            process_row(idx, dict(zip(columns, values)))
+            for idx, *values in missing_info.itertuples(index=True, name=None)
+        ))
+        apply_location_info(df, place_details)  # Parse and apply all the location results at once
+        await search_websites()
     
+    df = apply_results()
+    if stop_requested.is_set() or quota_reached:
+        save_state(df)  # Save state before exiting
     return df  # Return the updated DataFrame
 
 # %%
 
 def main():
     print("Loading the CSV file...")
-    df = pd.read_csv('missing_websites.csv')  # Load the CSV file containing missing information
+    df = pd.read_csv('missing_websites.csv', dtype=CSV_DTYPES, na_values=CSV_NA_VALUES)  # Load the CSV file containing missing information
     print("CSV file loaded successfully. Finding and updating missing information...")
     
-    updated_df = find_missing_info(df)  # Find and update missing information
+    updated_df = asyncio.run(find_missing_info(df))  # Find and update missing information
     print("Missing information updated successfully. Saving final results...")
 
     output_file = 'companies_info_updated.csv'  # Default output filename
@@ -282,7 +517,7 @@ def main():
     print("Final results saved to 'companies_info_updated.csv'.")
     # Print summary of updates
     print("\nSummary of updates:")
-    for column in ['Company website', 'Country', 'City', 'Province', 'Site address']:
+    for column in INFO_COLUMNS:
         before = len(df[df[column].isna()])  # Count missing entries before update
         after = len(updated_df[updated_df[column].isna()])  # Count missing entries after update
         print(f"{column}:")
@@ -292,10 +527,11 @@ def main():
         print()
 
     # Remove any saved state upon successful completion
-    if os.path.exists(STATE_FILE):
-        os.remove(STATE_FILE)  # Delete the state file after successful run
-        print("Removed temporary state file after successful run.")
+    for state_file in [STATE_FILE, state_csv_file(STATE_FILE)]:
+        if os.path.exists(state_file):
+            os.remove(state_file)  # Delete the state file after successful run
+            print("Removed temporary state file after successful run.")
 
 # %%
 if __name__ == "__main__":
-main()  # Execute the main function to start the process
+    main()  # Execute the main function to start the process
@@ -1,23 +1,49 @@
 # %%
 import asyncio
+import functools
 import io
+import multiprocessing
 import os
+import random
+import sys
 import time
-from urllib.parse import urljoin, urlparse, urlunparse
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse, urlsplit, urlunparse
 
 import aiohttp
 import nest_asyncio
 import pandas as pd
 import PyPDF2
 from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from itertools import islice
-import math
 import validators
 from urllib3.util import parse_url
 from aiohttp import ClientTimeout
+from aiohttp.resolver import AsyncResolver
 from asyncio import TimeoutError
 
+try:
+    import ahocorasick  # Optional: matches every keyword in a single pass over the page
+except ImportError:
+    ahocorasick = None
+
+try:
+    import pypdfium2 as pdfium  # Optional: C-backed PDF text extraction, much faster than PyPDF2
+except ImportError:
+    pdfium = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser  # Optional: C-backed HTML parsing, much faster than BeautifulSoup
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import aiodns  # Optional: lets aiohttp resolve DNS asynchronously through c-ares
+except ImportError:
+    aiodns = None
+
 # nest_asyncio.apply() # for running async code in notebook
 
 # %%
@@ -40,17 +66,95 @@ CERT_KEYWORDS = {
     ]
 }
 
+# Maximum number of websites crawled at the same time
+MAX_CONCURRENT_SITES = 50
+
+# Maximum number of pages fetched from a single website at the same time
+MAX_CONCURRENT_PAGES_PER_SITE = 4
+
+# Larger PDFs are skipped to prevent memory issues
+MAX_PDF_BYTES = 10 * 1024 * 1024  # 10MB limit
+
+# Retries allowed per host across a whole crawl, so a struggling site can't stall it
+MAX_RETRIES_PER_HOST = 10
+MAX_RETRY_DELAY = 30  # Seconds; longer Retry-After values are capped to this
+
+# Links to these file types can't hold HTML or PDF text, so they're never fetched
+SKIPPED_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.bmp', '.tif', '.tiff',
+    '.mp4', '.mov', '.avi', '.wmv', '.webm', '.mp3', '.wav',
+    '.zip', '.rar', '.7z', '.gz', '.tar', '.exe', '.dmg',
+    '.css', '.js', '.xml', '.json', '.woff', '.woff2', '.ttf'
+)
+
+# Page text is lowercased before matching, so lowercase the keywords once up front
+CERT_KEYWORDS_LC = {col: [kw.lower() for kw in kws] for col, kws in CERT_KEYWORDS.items()}
+
+# %%
+def build_keyword_automaton(cert_keywords: dict):
+    """
+    Build an Aho-Corasick automaton mapping each lowercased keyword to its certification column.
+    Returns None when pyahocorasick isn't installed.
+    """
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for cert_col, kws in cert_keywords.items():
+        for kw in kws:
+            automaton.add_word(kw.lower(), (cert_col, kw))
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATON = build_keyword_automaton(CERT_KEYWORDS)
+
+# %%
+def find_certs_in_text(page_text: str, cert_keywords_lc: dict, automaton=None) -> set:
+    """
+    Returns the certification columns with at least one keyword in page_text.
+    Both page_text and the cert_keywords_lc keywords are expected to be lowercased already.
+    Scans the text once with the automaton when available, otherwise checks each keyword in turn.
+    """
+    certs = set()
+    if automaton is not None:
+        for _, (cert_col, _) in automaton.iter(page_text):
+            certs.add(cert_col)
+            if len(certs) == len(cert_keywords_lc):
+                break  # Every certification is already matched; no need to scan the rest of the page
+        return certs
+    
+    for cert_col, kws_lc in cert_keywords_lc.items():
+        for kw in kws_lc:
+            if kw in page_text:
+                certs.add(cert_col)
+                break  # One match is enough; skip the cert's remaining keywords
+    return certs
+
 # %%
 def extract_text_from_pdf(pdf_content: bytes) -> str:
     """
     Enhanced PDF text extraction with better error handling and memory management.
+    Uses pypdfium2 when it's installed, otherwise falls back to PyPDF2.
     """
     text = ""
     try:
         # Limit PDF size to prevent memory issues
-        if len(pdf_content) > 10 * 1024 * 1024:  # 10MB limit
+        if len(pdf_content) > MAX_PDF_BYTES:
             print("[PDF ERROR] File too large")
             return ""
+        
+        if pdfium is not None:
+            with pdfium.PdfDocument(pdf_content) as pdf:
+                # Limit number of pages processed
+                max_pages = min(len(pdf), 50)
+                
+                text_parts = []
+                for page_num in range(max_pages):
+                    try:
+                        text_parts.append(pdf[page_num].get_textpage().get_text_range())
+                    except pdfium.PdfiumError as e:
+                        print(f"[PDF ERROR] Failed to extract page {page_num}: {e}")
+                        continue
+            return " ".join(text_parts).lower()
             
         with io.BytesIO(pdf_content) as pdf_file:
             try:
@@ -80,15 +184,107 @@ def extract_text_from_pdf(pdf_content: bytes) -> str:
     return text.lower()
 
 # %%
-def is_same_domain(base_url: str, new_url: str) -> bool:
-    """Returns True if new_url is on the same domain (or subdomain) as base_url."""
-    base_domain = urlparse(base_url).netloc
-    check_domain = urlparse(new_url).netloc
+def can_use_process_pool() -> bool:
+    """
+    Spawned workers have to re-import the module that defines extract_text_from_pdf.
+    That's impossible when it lives in a __main__ without a script file (notebook cells, code piped on stdin).
+    """
+    if extract_text_from_pdf.__module__ != '__main__':
+        return True
+    main_file = getattr(sys.modules['__main__'], '__file__', None)
+    return main_file is not None and os.path.isfile(main_file)
+
+# %%
+class PdfTextExtractor:
+    """
+    Runs extract_text_from_pdf off the event loop, since PDF parsing is CPU-bound and holds the GIL.
+    Uses a pool of worker processes when they can import this module, otherwise a thread.
+    Use as a context manager so the pool is shut down when the crawl is over.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.pool = None
+    
+    def new_pool(self):
+        # Workers are spawned rather than forked so they don't inherit copies of open crawler sockets
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+    
+    def __enter__(self):
+        if can_use_process_pool():
+            self.pool = self.new_pool()
+        else:
+            print("[INFO] PDF worker processes can't import this code; parsing PDFs in a thread instead")
+        return self
+    
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+    
+    async def extract_text(self, pdf_content: bytes) -> str:
+        if self.pool is None:
+            return await asyncio.to_thread(extract_text_from_pdf, pdf_content)
+        
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self.pool
+            try:
+                return await loop.run_in_executor(pool, extract_text_from_pdf, pdf_content)
+            except BrokenProcessPool:
+                # A worker crashed (a bad PDF or out of memory) and took the pool with it.
+                # Replace the pool once per breakage, then give this PDF one more try in the new pool.
+                if self.pool is pool:
+                    print("[PDF ERROR] PDF worker crashed, restarting the worker pool")
+                    pool.shutdown(wait=False)
+                    self.pool = self.new_pool()
+        # Broke a fresh pool too; don't risk parsing it in this process
+        print("[PDF ERROR] PDF crashed the worker pool twice, skipping")
+        return ""
+
+# %%
+def parse_html(html: str) -> tuple:
+    """
+    Parse an HTML page into its lowercased text and the hrefs of its links.
+    Uses selectolax when it's installed, otherwise falls back to BeautifulSoup.
+    """
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html)
+        tree.strip_tags(['script', 'style'])  # BeautifulSoup's get_text leaves these out too
+        page_text = tree.text(separator=' ').lower()
+        hrefs = [node.attributes['href'] or '' for node in tree.css('a[href]')]
+        return page_text, hrefs
+    
+    soup = BeautifulSoup(html, 'html.parser')
+    page_text = soup.get_text(separator=' ').lower()
+    hrefs = [link_tag['href'] for link_tag in soup.find_all("a", href=True)]
+    return page_text, hrefs
+
+# %%
+async def read_pdf_bytes(resp: aiohttp.ClientResponse) -> bytes:
+    """
+    Stream a PDF response body, giving up as soon as it grows past MAX_PDF_BYTES.
+    Returns None if the PDF is too large.
+    """
+    # Skip without downloading anything when the server tells us the size up front
+    if resp.content_length is not None and resp.content_length > MAX_PDF_BYTES:
+        return None
+    
+    buf = bytearray()
+    async for chunk in resp.content.iter_chunked(64 * 1024):
+        buf.extend(chunk)
+        if len(buf) > MAX_PDF_BYTES:
+            return None
+    return bytes(buf)
+
+# %%
+def is_same_domain(base_domain: str, check_domain: str) -> bool:
+    """Returns True if the check_domain netloc is on the same domain (or subdomain) as the base_domain netloc."""
     # A loose check: ensure the base domain is a substring of check_domain
     # e.g. base: "example.com", check: "sub.example.com" => True
     return base_domain in check_domain
 
 # %%
+@functools.lru_cache(maxsize=100_000)
 def clean_and_validate_url(url: str) -> str:
     """Cleans and validates a URL, returns None if invalid."""
     if not url:
@@ -110,6 +306,10 @@ def clean_and_validate_url(url: str) -> str:
         return None
 
 # %%
+# Tracking parameters dropped from URLs before they're recorded
+BLOCKED_QUERY_PARAMS = frozenset({'utm_source', 'utm_medium', 'utm_campaign', 'fbclid', 'gclid'})
+
+@functools.lru_cache(maxsize=100_000)
 def normalize_url(url: str) -> str:
     """Improved URL normalization with better error handling."""
     try:
@@ -120,14 +320,13 @@ def normalize_url(url: str) -> str:
         path = parsed.path.lower()
         
         # Remove common tracking parameters
-        query_params = urlparse(url).query.split('&')
+        query_params = parsed.query.split('&')
         filtered_params = []
-        blocked_params = {'utm_source', 'utm_medium', 'utm_campaign', 'fbclid', 'gclid'}
         
         for param in query_params:
             if '=' in param:
                 name = param.split('=')[0]
-                if name not in blocked_params:
+                if name not in BLOCKED_QUERY_PARAMS:
                     filtered_params.append(param)
                     
         query = '&'.join(filtered_params)
@@ -158,11 +357,13 @@ async def crawl_for_keywords_async(
     cert_keywords: dict,
     max_depth: int = 2,
     limit_pages: int = 50,
-    politeness_delay: float = 0.5
+    politeness_delay: float = 0.5,
+    pdf_extractor: PdfTextExtractor = None
 ) -> dict:
     """
     Asynchronously crawl a website starting from seed_url, searching for certification keywords.
-    Uses breadth-first search (BFS) to explore links up to max_depth away from the seed URL.
+    Uses breadth-first search (BFS) to explore links up to max_depth away from the seed URL,
+    fetching all pages of one depth concurrently before moving on to the next.
     
     Args:
         session: aiohttp client session for making HTTP requests
@@ -170,7 +371,8 @@ async def crawl_for_keywords_async(
         cert_keywords: Dictionary mapping certification columns to lists of keywords
         max_depth: Maximum link depth to explore from seed_url (default: 2)
         limit_pages: Maximum total pages to fetch across all depths (default: 50)
-        politeness_delay: Seconds to wait between requests to same domain (default: 0.5)
+        politeness_delay: Minimum seconds between the starts of requests to the same host (default: 0.5)
+        pdf_extractor: PdfTextExtractor to parse PDFs with (default: parse in a thread)
     
     Returns:
         Dictionary mapping certification columns to sets of URLs where keywords were found
@@ -184,191 +386,264 @@ async def crawl_for_keywords_async(
     # Track visited URLs to avoid cycles
     visited = set()
     
-    # Queue for BFS traversal - each item is (url, depth) tuple
-    queue = asyncio.Queue()
-    await queue.put((seed_url, 0))
-
+    # Reuse the module-level keyword matchers unless we were given different keywords
+    if cert_keywords is CERT_KEYWORDS:
+        automaton, keywords_lc = KEYWORD_AUTOMATON, CERT_KEYWORDS_LC
+    else:
+        automaton = build_keyword_automaton(cert_keywords)
+        keywords_lc = {col: [kw.lower() for kw in kws] for col, kws in cert_keywords.items()}
+    
     pages_crawled = 0
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES_PER_SITE)  # Bound the requests in flight to this site
+    next_fetch_times = {}  # Earliest time the next request to each host may start
+    retry_budget = {}  # Retries each host has left in this crawl
     
     print(f"Starting crawl from: {seed_url}")
     
-    while not queue.empty():
-        try:
-            current_url, depth = await queue.get()
-            queue.task_done()
-
-            # Add URL validation
-            current_url = clean_and_validate_url(current_url)
-            if not current_url:
-                continue
-
-            # Skip if we've exceeded max depth
-            if depth > max_depth:
-                continue
+    async def crawl_page(current_url, host, depth):
+        """Fetch one page, record its keyword matches and return the URLs it links to."""
+        nonlocal pages_crawled
+        async with semaphore:
+            # Respect crawl delay: start requests to the same host at least politeness_delay apart
+            now = time.monotonic()
+            fetch_time = max(now, next_fetch_times.get(host, now))
+            next_fetch_times[host] = fetch_time + politeness_delay  # Claim the slot before waiting for it
+            if fetch_time > now:
+                await asyncio.sleep(fetch_time - now)
             
-            # Skip if already visited this URL
-            if current_url in visited:
-                continue
-            visited.add(current_url)
-
-            # Only crawl URLs on same domain as seed
-            if not is_same_domain(seed_url, current_url):
-                continue
-
-            # Stop if we've hit the page limit
-            if pages_crawled >= limit_pages:
-                break
-
-            # Respect crawl delay
-            await asyncio.sleep(politeness_delay)
-
             try:
-                async with session.get(current_url, timeout=10) as resp:
-                    if resp.status != 200:
-                        print(f"[WARNING] {current_url} returned status {resp.status}")
-                        continue
-                    pages_crawled += 1
-                    print(f"[INFO] Crawled: {current_url} (Total pages crawled: {pages_crawled})")
-                    
-                    content_type = resp.headers.get('Content-Type', '').lower()
+                # Retries transient failures, honouring Retry-After, within this crawl's retry budget
+                content, content_type = await fetch_with_retry(
+                    session, current_url, retry_budget=retry_budget, timeout=ClientTimeout(total=10)
+                )
+                if content_type is None:
+                    return []
+                pages_crawled += 1
+                print(f"[INFO] Crawled: {current_url} (Total pages crawled: {pages_crawled})")
+                
+                if 'pdf' in content_type:
+                    # For PDFs: download bytes, extract text, check for keywords
+                    if content is None:
+                        print(f"[PDF ERROR] {current_url} is larger than {MAX_PDF_BYTES} bytes, skipping")
+                        return []
+                    if pdf_extractor is not None:
+                        pdf_text = await pdf_extractor.extract_text(content)
+                    else:
+                        pdf_text = await asyncio.to_thread(extract_text_from_pdf, content)
+                    certs_found = find_certs_in_text(pdf_text, keywords_lc, automaton)
+                    if certs_found:
+                        normalized = normalize_url(current_url)
+                        for cert_col in certs_found:
+                            found_urls_by_cert[cert_col].add(normalized)
+                
+                elif 'html' in content_type:
+                    # For HTML: parse content, extract text, check for keywords
+                    page_text, hrefs = parse_html(content)
                     
-                    if 'pdf' in content_type:
-                        # For PDFs: download bytes, extract text, check for keywords
-                        pdf_bytes = await resp.read()
-                        pdf_text = extract_text_from_pdf(pdf_bytes)
-                        for cert_col, kws in cert_keywords.items():
-                            for kw in kws:
-                                if kw.lower() in pdf_text:
-                                    normalized = normalize_url(current_url) 
-                                    found_urls_by_cert[cert_col].add(normalized)
+                    # Check each certification's keywords against page text
+                    certs_found = find_certs_in_text(page_text, keywords_lc, automaton)
+                    if certs_found:
+                        normalized = normalize_url(current_url)
+                        for cert_col in certs_found:
+                            found_urls_by_cert[cert_col].add(normalized)
                     
-                    elif 'html' in content_type:
-                        # For HTML: parse content, extract text, check for keywords
-                        html = await resp.text(errors='ignore')
-                        soup = BeautifulSoup(html, 'html.parser')
-                        page_text = soup.get_text(separator=' ').lower()
-
-                        # Check each certification's keywords against page text
-                        for cert_col, kws in cert_keywords.items():
-                            for kw in kws:
-                                if kw.lower() in page_text:
-                                    normalized = normalize_url(current_url)
-                                    found_urls_by_cert[cert_col].add(normalized)
-
-                        # If not at max depth, add all links to queue
-                        if depth < max_depth:
-                            for link_tag in soup.find_all("a", href=True):
-                                child_url = urljoin(current_url, link_tag['href'])
-                                if child_url not in visited:
-                                    await queue.put((child_url, depth + 1))
-                    else:
-                        # Skip non-HTML/PDF content types
-                        pass
-
+                    # If not at max depth, follow all links on the next level
+                    if depth < max_depth:
+                        return [urljoin(current_url, href) for href in hrefs]
+                # Skip non-HTML/PDF content types
+            
             except Exception as e:
                 print(f"[ERROR] {current_url} => {e}")
+        return []
+    
+    # BFS one depth at a time, fetching every page of a level concurrently
+    seed_domain = urlsplit(seed_url).netloc
+    frontier = [seed_url]
+    for depth in range(max_depth + 1):
+        level_urls = []
+        for url in frontier:
+            # Skip if already visited this URL, before paying for validation
+            if url in visited:
                 continue
-
-        except asyncio.TimeoutError:
-            print(f"[TIMEOUT] {current_url}")
-            continue
-        except aiohttp.ClientError as e:
-            print(f"[HTTP ERROR] {current_url}: {e}")
-            continue
-        except Exception as e:
-            print(f"[UNEXPECTED ERROR] {current_url}: {e}")
-            continue
-
+            visited.add(url)
+            
+            # Add URL validation
+            cleaned_url = clean_and_validate_url(url)
+            if not cleaned_url:
+                continue
+            if cleaned_url != url:
+                # Different raw URLs can clean up to the same one
+                if cleaned_url in visited:
+                    continue
+                visited.add(cleaned_url)
+            url = cleaned_url
+            
+            # Parse once for the domain, file type and politeness checks
+            parsed = urlsplit(url)
+            
+            # Only crawl URLs on same domain as seed
+            if not is_same_domain(seed_domain, parsed.netloc):
+                continue
+            
+            # Skip images, media and other files we couldn't read anyway
+            if parsed.path.lower().endswith(SKIPPED_EXTENSIONS):
+                continue
+            level_urls.append((url, parsed.netloc))
+        
+        # Stop if we've hit the page limit
+        level_urls = level_urls[:limit_pages - pages_crawled]
+        if not level_urls:
+            break
+        
+        child_urls = await asyncio.gather(*(crawl_page(url, host, depth) for url, host in level_urls))
+        frontier = [url for urls in child_urls for url in urls]
+    
     return found_urls_by_cert
 
 # %%
 async def process_df_with_sites(df_with_sites: pd.DataFrame) -> pd.DataFrame:
     """
-    Process websites in parallel batches for better performance.
+    Crawl all websites concurrently, bounded by MAX_CONCURRENT_SITES.
     """
     # Add error handling for invalid URLs
     df_with_sites['Company website'] = df_with_sites['Company website'].apply(clean_and_validate_url)
     df_with_sites = df_with_sites.dropna(subset=['Company website'])
     
-    # Increase connector limit and add timeout
+    # Keep connections alive between requests and cache DNS lookups
     timeout = ClientTimeout(total=30, connect=10)
-    connector = aiohttp.TCPConnector(limit=20, force_close=True)
+    # The default resolver runs getaddrinfo in a thread pool, which backs up with hundreds of hosts
+    resolver = AsyncResolver() if aiodns is not None else None
+    connector = aiohttp.TCPConnector(
+        limit=200, limit_per_host=4, resolver=resolver, ttl_dns_cache=600, use_dns_cache=True
+    )
     
-    async with aiohttp.ClientSession(
-        connector=connector,
-        timeout=timeout,
-        headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-    ) as session:
-        # Calculate optimal batch size based on DataFrame length
-        batch_size = min(10, math.ceil(len(df_with_sites) / 4))
+    # Parse PDFs in worker processes that live as long as the crawl
+    with PdfTextExtractor() as pdf_extractor:
+        async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/pdf;q=0.9,*/*;q=0.1'  # We only read HTML and PDFs
+            }
+        ) as session:
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_SITES)  # Bound the sites crawled at once
         
-        # Process in batches
-        for start_idx in range(0, len(df_with_sites), batch_size):
-            batch = df_with_sites.iloc[start_idx:start_idx + batch_size]
-            print(f"[INFO] Processing batch starting at index {start_idx} (Batch size: {len(batch)})")
-            
-            # Create tasks for each website in the batch
-            tasks = []
-            for idx, row in batch.iterrows():
-                seed_url = row["Company website"]
+            async def bounded_crawl(idx, seed_url):
+                async with semaphore:
+                    try:
+                        return idx, await crawl_for_keywords_async(
+                            session=session,
+                            seed_url=seed_url,
+                            cert_keywords=CERT_KEYWORDS,
+                            max_depth=2,
+                            limit_pages=50,
+                            politeness_delay=0.5,
+                            pdf_extractor=pdf_extractor
+                        )
+                    except Exception as e:
+                        return idx, e  # A failed site doesn't cancel the others
+        
+            sites = []
+            for idx, seed_url in df_with_sites['Company website'].items():
                 if not seed_url.startswith("http"):
                     seed_url = "http://" + seed_url
-                
                 print(f"\nQueuing: {seed_url} (index: {idx})")
-                
-                task = crawl_for_keywords_async(
-                    session=session,
-                    seed_url=seed_url,
-                    cert_keywords=CERT_KEYWORDS,
-                    max_depth=2,
-                    limit_pages=50,
-                    politeness_delay=0.5
-                )
-                tasks.append((idx, task))
-            
-            # Wait for all tasks in batch to complete
-            for idx, task in tasks:
-                try:
-                    found_by_cert = await task
-                    # Update DataFrame with results
-                    for cert_col, found_urls in found_by_cert.items():
-                        if found_urls:
-                            existing_val = df_with_sites.at[idx, cert_col]
-                            if not isinstance(existing_val, str):
-                                existing_val = ""
-                            old_urls = set(u.strip() for u in existing_val.split(";") if u.strip())
-                            merged = old_urls.union(found_urls)
-                            df_with_sites.at[idx, cert_col] = ";".join(sorted(merged))
-                except Exception as e:
-                    print(f"[ERROR] Failed to process index {idx}: {e}")
+                sites.append((idx, seed_url))
+        
+            # Start every crawl at once and handle each site as soon as it finishes,
+            # so a slow site never holds up the others
+            tasks = [asyncio.create_task(bounded_crawl(idx, seed_url)) for idx, seed_url in sites]
+        
+            updates = []  # New cert URLs per row, applied to the DataFrame in one pass
+            for sites_done, next_done in enumerate(asyncio.as_completed(tasks), start=1):
+                idx, found_by_cert = await next_done
+                print(f"[INFO] Finished index {idx} ({sites_done}/{len(tasks)} sites)")
+                if isinstance(found_by_cert, Exception):
+                    print(f"[ERROR] Failed to process index {idx}: {found_by_cert}")
+                    continue
+                # Merge the found URLs with the ones already recorded
+                row_update = {'idx': idx}
+                for cert_col, found_urls in found_by_cert.items():
+                    if found_urls:
+                        existing_val = df_with_sites.at[idx, cert_col]
+                        if not isinstance(existing_val, str):
+                            existing_val = ""
+                        old_urls = set(u.strip() for u in existing_val.split(";") if u.strip())
+                        merged = old_urls.union(found_urls)
+                        row_update[cert_col] = ";".join(sorted(merged))
+                if len(row_update) > 1:
+                    updates.append(row_update)
+        
+            # Update DataFrame with results
+            if updates:
+                df_with_sites.update(pd.DataFrame(updates).set_index('idx'))
     
     return df_with_sites
 
 # %%
-async def fetch_with_retry(session: aiohttp.ClientSession, url: str, max_retries: int = 3) -> tuple:
+def retry_delay(resp: aiohttp.ClientResponse, attempt: int) -> float:
+    """
+    How long to wait before retrying a rate-limited response.
+    Uses the server's Retry-After header when present, otherwise exponential backoff with jitter.
+    """
+    retry_after = resp.headers.get('Retry-After')
+    if retry_after:
+        try:
+            delay = float(retry_after)  # Seconds to wait
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()  # HTTP date to wait until
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), MAX_RETRY_DELAY)
+    # Jitter keeps concurrent crawls from retrying in lockstep
+    return min(2 ** attempt + random.uniform(0, 1), MAX_RETRY_DELAY)
+
+# %%
+async def fetch_with_retry(
+    session: aiohttp.ClientSession,
+    url: str,
+    max_retries: int = 3,
+    retry_budget: dict = None,
+    timeout: ClientTimeout = ClientTimeout(total=30)
+) -> tuple:
     """
     Fetch a URL with retry logic for better reliability.
-    Returns (content, content_type) tuple.
+    Retries rate-limited (429) and unavailable (503) responses as well as network errors.
+    retry_budget, if given, maps each host to the retries it has left and is shared across calls.
+    Returns (content, content_type) tuple: bytes for PDFs, text for HTML, and no content for
+    other types or PDFs over MAX_PDF_BYTES. Both are None if the fetch failed.
     """
-    timeout = ClientTimeout(total=30)
+    host = urlsplit(url).netloc
     
     for attempt in range(max_retries):
+        if attempt > 0 and retry_budget is not None:
+            if retry_budget.get(host, MAX_RETRIES_PER_HOST) <= 0:
+                print(f"[ERROR] Out of retries for {host}, giving up on {url}")
+                return None, None
+            retry_budget[host] = retry_budget.get(host, MAX_RETRIES_PER_HOST) - 1
+        
         try:
             async with session.get(url, timeout=timeout) as resp:
                 if resp.status == 200:
                     content_type = resp.headers.get('Content-Type', '').lower()
                     if 'pdf' in content_type:
-                        content = await resp.read()
-                    else:
+                        content = await read_pdf_bytes(resp)
+                    elif 'html' in content_type:
                         content = await resp.text(errors='ignore')
+                    else:
+                        content = None  # We don't read other content types
                     return content, content_type
                     
                 elif resp.status in {429, 503}:  # Rate limited or service unavailable
-                    wait_time = min(2 ** attempt, 8)  # Exponential backoff
-                    await asyncio.sleep(wait_time)
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(retry_delay(resp, attempt))
                     continue
                     
                 else:
+                    print(f"[WARNING] {url} returned status {resp.status}")
                     return None, None
                     
         except (TimeoutError, aiohttp.ClientError) as e:
@@ -376,7 +651,8 @@ async def fetch_with_retry(session: aiohttp.ClientSession, url: str, max_retries
                 print(f"[ERROR] Failed to fetch {url} after {max_retries} attempts: {e}")
                 return None, None
             await asyncio.sleep(1)
-            
+    
+    print(f"[WARNING] {url} still rate limited after {max_retries} attempts")
     return None, None
 
 # %%
@@ -384,7 +660,8 @@ async def main():
     try:
         # Load company data from Google Sheets into DataFrame
         print("Loading company data from CSV...")
-        df_all = pd.read_csv("companies_info_updated.csv")
+        # Every column is text, so skip dtype inference and keep values exactly as written
+        df_all = pd.read_csv("companies_info_updated.csv", dtype=str)
         print("Company data loaded successfully.")
         
         # Initialize and standardize certification columns as empty strings
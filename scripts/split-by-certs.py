@@ -6,27 +6,31 @@ plants_df = pd.read_csv('../data/plants_updated_certification_and_info.csv')
 plants_df.columns
 # %%
 cert_columns = ['BAP Cert', 'ASC Cert', 'FOS Cert', 'FIP Cert', 'MarinTrust Cert']
-new_rows = []
 
-for _, row in plants_df.iterrows():
-    for cert in cert_columns:
-        urls = row.get(cert, '')
-        if pd.notnull(urls):
-            split_urls = [url.strip() for url in urls.split(';') if url.strip()]
-            for url in split_urls:
-                new_row = row.copy()
-                new_row[cert] = url
-                # Clear other certification columns
-                for other_cert in cert_columns:
-                    if other_cert != cert:
-                        new_row[other_cert] = ''
-                new_rows.append(new_row)
+# Add any certification columns missing from the input as empty ones
+plants_df = plants_df.reindex(columns=[*plants_df.columns, *[c for c in cert_columns if c not in plants_df]])
 
-# Create a new DataFrame with the expanded rows
-split_plants_df = pd.DataFrame(new_rows)
+# Unpivot to one row per (plant, certification) and explode the ';'-separated URLs
+id_columns = [col for col in plants_df.columns if col not in cert_columns]
+long_df = plants_df.melt(
+    id_vars=id_columns,
+    value_vars=cert_columns,
+    var_name='cert_type',
+    value_name='cert_url',
+    ignore_index=False
+)
+long_df['cert_url'] = long_df['cert_url'].fillna('').astype(str).str.split(';')
+long_df = long_df.explode('cert_url')
+long_df['cert_url'] = long_df['cert_url'].str.strip()
+long_df = long_df[long_df['cert_url'].notna() & (long_df['cert_url'] != '')]
 
-# Reset the index of the new DataFrame
-split_plants_df.reset_index(drop=True, inplace=True)
+# Restore the original row order (plant, then certification, then URL) and reset the index
+long_df = long_df.sort_index(kind='stable').reset_index(drop=True)
+
+# Put each URL back in its own certification column and clear the other certification columns
+for cert in cert_columns:
+    long_df[cert] = long_df['cert_url'].where(long_df['cert_type'] == cert, '')
+split_plants_df = long_df[plants_df.columns]
 
 # Replace the original DataFrame with the split DataFrame
 plants_df = split_plants_df